@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Query a locally running saros-fit-server.py and time the responses
+
+# import libraries
+import pandas as pd
+import requests
+import time
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+server_url = 'http://localhost:8765'
+
+
+def get_frame(path, params={}):
+    start = time.time()
+    res = requests.get(server_url + path, params=params)
+
+    if res.headers['Content-Type'] == 'application/vnd.apache.arrow.stream':
+        df = pa.ipc.open_stream(res.content).read_pandas()
+    else:
+        df = pd.DataFrame(res.json())
+
+    print(path, params, ' rows: ', len(df), ' ms: ', round((time.time() - start) * 1000, 1))
+    return df
+
+
+print(requests.get(server_url + '/status').json())
+
+activities = get_frame('/activities')
+print(activities.tail(5))
+
+# most recent activity, every stream plus its name
+latest = activities['id'][pd.to_datetime(activities['date']).idxmax()]
+print(get_frame('/streams', {'ids': str(latest), 'columns': 'time,distance,heartrate,watts,name'}).head())
+
+# heartrate for every run this year
+get_frame('/streams', {'type': 'Run', 'after': str(pd.Timestamp.now().year) + '-01-01',
+                       'columns': 'time,heartrate,date'})
+
+print("\nEXITING SAROS FIT\n")
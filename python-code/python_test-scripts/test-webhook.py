@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Stand-in for Strava: post synthetic webhook events to a locally running saros-fit-webhook.py
+# (https://developers.strava.com/docs/webhooks/)
+
+# import libraries
+import requests
+import sqlite3
+import time
+
+webhook_url = 'http://localhost:8080/webhook'
+verify_token = 'SAROSFIT'
+
+# activity id to use in the synthetic events (use a real one of yours to exercise the worker as well)
+test_activity = 4998708851
+
+
+# subscription validation, the same GET Strava sends when the subscription is created
+res = requests.get(webhook_url, params={'hub.mode': 'subscribe',
+                                        'hub.verify_token': verify_token,
+                                        'hub.challenge': 'test-challenge'})
+print('Validation:  ', res.status_code, res.json())
+
+res = requests.get(webhook_url, params={'hub.mode': 'subscribe',
+                                        'hub.verify_token': 'wrong-token',
+                                        'hub.challenge': 'test-challenge'})
+print('Wrong token: ', res.status_code, res.json())
+
+
+def post_event(object_type, aspect_type, object_id, updates={}):
+    event = {
+        'object_type': object_type,
+        'object_id': object_id,
+        'aspect_type': aspect_type,
+        'owner_id': 134815,
+        'subscription_id': 120475,
+        'event_time': int(time.time()),
+        'updates': updates
+    }
+    res = requests.post(webhook_url, json=event)
+    print('Posted ' + object_type + ' ' + aspect_type + ': ', res.status_code)
+
+
+post_event('activity', 'create', test_activity)
+post_event('activity', 'update', test_activity, {'title': 'Renamed Activity'})
+post_event('activity', 'update', test_activity + 1, {'type': 'Ride'})
+post_event('activity', 'delete', test_activity + 2)
+
+# athlete events should be acknowledged but not queued
+post_event('athlete', 'update', 134815, {'authorized': 'false'})
+
+print("\nQUEUED EVENTS\n")
+conn = sqlite3.connect('activities_queue.db')
+for row in conn.execute('SELECT seq, object_id, aspect_type, event_time FROM queue ORDER BY seq'):
+    print(row)
+conn.close()
+
+print("\nEXITING SAROS FIT\n")
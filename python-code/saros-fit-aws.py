@@ -45,6 +45,7 @@ import requests
 import urllib3
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+import json
 import codecs
 from codecs import open
 from datetime import date
@@ -103,6 +104,57 @@ def get_secret(secret_name, region_name = "us-east-1"):
     return secret
 
 
+# ## Resume Pending Work
+# When the Strava rate limit runs out, the activities still to download and the time the limit resets are saved in
+# saros-fit-jobs.json (and the s3 bucket) and the script exits rather than sleeping on the instance.  Run it on a
+# schedule (cron, systemd timer, Lambda) and each run carries on where the last one stopped, e.g.
+#   */20 * * * *  cd /home/ec2-user/sarosfit && python3 saros-fit-aws.py
+jobs_file = 'saros-fit-jobs.json'
+
+try:
+    if not os.path.exists(jobs_file):
+        cli.download_file(
+            Bucket='sarosfit',
+            Key='data/' + jobs_file,
+            Filename=jobs_file)
+
+    with open(jobs_file, 'r') as f:
+        jobs = json.load(f)
+except:
+    jobs = {'pending': [], 'resume_after': 0}
+
+if time.time() < jobs['resume_after']:
+    print("\nStrava rate limit resets at " + str(pd.Timestamp(jobs['resume_after'], unit='s')) + " UTC, " +
+          str(len(jobs['pending'])) + " activities waiting")
+    print("EXITING SAROS FIT\n")
+    sys.exit(0)
+
+# 90 rather than 100 to be safe (100 requests per 15min limit and 1000 per day)
+rate_budget = [90, 990]
+rate_usage = [0, 0]
+
+
+# Strava returns the requests used in the current 15 minutes and the current day with every response
+def track_rate(res):
+    global rate_usage
+    try:
+        rate_usage = [int(u) for u in res.headers['X-RateLimit-Usage'].split(',')]
+    except:
+        rate_usage = [rate_usage[0] + 1, rate_usage[1] + 1]
+    return res
+
+
+def rate_exhausted():
+    return rate_usage[0] >= rate_budget[0] or rate_usage[1] >= rate_budget[1]
+
+
+# 15 minute limits reset on the quarter hour and daily limits at midnight UTC
+def rate_reset():
+    now = pd.Timestamp.now(tz='UTC')
+    if rate_usage[1] >= rate_budget[1]:
+        return (now.floor('D') + pd.Timedelta(days=1)).timestamp()
+    return (now.floor('15min') + pd.Timedelta(minutes=15)).timestamp()
+
 
 # ## Connect to Strava -- Get Current Access Token
 # (https://towardsdatascience.com/how-i-manage-credentials-in-python-using-aws-secrets-manager-1bd1bf5da598)
@@ -129,20 +181,64 @@ print("")
 
 # ## Create Dataframe with Summary Info for All Activities *(Strava API)*
 # (http://www.hainke.ca/index.php/2018/08/23/using-the-strava-api-to-retrieve-activity-data/)
-# Initialize the dataframe
-activities_overview = pd.DataFrame()
+# Only activities that started after the newest one already in activities_overview.csv are requested.  The start
+# time and id of the newest activity are kept in activities_overview_sync.json.  Every full_sync_days the whole
+# list is downloaded again to pick up edited and deleted activities.
+full_sync_days = 7
+sync_file = 'activities_overview_sync.json'
+
+try:
+    # Check to see if there is a local file
+    activities_overview = pd.read_csv('activities_overview.csv', index_col=0)
+except:
+    try:
+        # Check the s3 bucket to see if there is a file
+        cli.download_file(
+            Bucket='sarosfit',
+            Key='data/activities_overview.csv',
+            Filename='activities_overview.csv')
+        cli.download_file(
+            Bucket='sarosfit',
+            Key='data/activities_overview_sync.json',
+            Filename=sync_file)
+
+        activities_overview = pd.read_csv('activities_overview.csv', index_col=0)
+    except:
+        # Create a new empty dataframe (usually because first run)
+        activities_overview = pd.DataFrame()
+
+try:
+    with open(sync_file, 'r') as f:
+        overview_sync = json.load(f)
+except:
+    overview_sync = {}
+
+full_sync = (activities_overview.empty or 'after' not in overview_sync or
+             time.time() - overview_sync.get('last_full_sync', 0) > full_sync_days * 86400)
+
+# Initialize the dataframe for the activities downloaded in this run
+activities_new = pd.DataFrame()
 
 url = "https://www.strava.com/api/v3/athlete/activities"
 page = 1
 
+if full_sync:
+    print("Downloading all activities...")
+    after = ''
+else:
+    print("Downloading activities since " + str(pd.Timestamp(overview_sync['after'], unit='s')) + "...")
+    # one second back so an activity starting on the same second as the newest one is not missed
+    after = '&after=' + str(int(overview_sync['after']) - 1)
+
 while True:
     # get page of activities from Strava
-    page_json = requests.get(url + '?access_token=' + access_token + '&per_page=200' + '&page=' + str(page)).json()
+    page_json = track_rate(requests.get(url + '?access_token=' + access_token + '&per_page=200' + '&page=' +
+                                        str(page) + after)).json()
 
     for a in range(len(page_json)):
         # (https://stackoverflow.com/questions/21104592/)
         activity_json = pd.json_normalize(page_json[a])
-        activities_overview = activities_overview.append(activity_json, ignore_index=True)
+        activities_new = pd.concat([activities_new, activity_json], ignore_index=True)
 
     # if no results then exit loop
     if (not page_json):
@@ -151,23 +247,77 @@ while True:
     # increment page
     page += 1
 
-# makes sense since new added on bottom
-activities_overview = activities_overview.sort_values(by='id', ascending=True)
+if full_sync and not activities_new.empty:
+    # makes sense since new added on bottom
+    activities_overview = activities_new.sort_values(by='id', ascending=True)
+
+    activities_overview.to_csv('activities_overview.csv', header=True)
+    overview_sync['last_full_sync'] = int(time.time())
+
+elif not activities_new.empty:
+    # merge the new activities into the stored overview by appending them to the end of the csv file
+    activities_new = activities_new[~activities_new['id'].isin(activities_overview['id'])]
+    activities_new = activities_new.sort_values(by='id', ascending=True)
+    activities_new = activities_new.reindex(columns=activities_overview.columns)
+    activities_new.index = range(activities_overview.index.max() + 1,
+                                 activities_overview.index.max() + 1 + len(activities_new))
+
+    activities_new.to_csv('activities_overview.csv', mode='a', header=False)
+    activities_overview = pd.concat([activities_overview, activities_new])
 
 # activities_overview.tail(5)
 
+print("Number of Activities Downloaded:   ", len(activities_new))
 print("Number of Strava Activities Found: ", activities_overview.shape)
 print("")
 
-activities_overview.to_csv('activities_overview.csv', header=True)
+# high-water mark for the next run
+if not activities_overview.empty:
+    newest = pd.to_datetime(activities_overview['start_date'], utc=True).idxmax()
+    overview_sync['after'] = int(pd.Timestamp(activities_overview['start_date'][newest]).timestamp())
+    overview_sync['latest_id'] = int(activities_overview['id'][newest])
+
+with open(sync_file, 'w') as f:
+    json.dump(overview_sync, f)
+
 print("OVERVIEW CSV FILE UPDATED\n")
 
+# ## Activity Table for Joining to the Streams
+# the date, name and type of each activity are stored once here instead of on every row of the details, join them
+# when they are needed:  activities_details.join(activities_activity, on='id')
+activities_activity = activities_overview.set_index('id')[['start_date_local', 'name', 'type']]
+activities_activity = activities_activity.rename(columns={'start_date_local': 'date'})
+
+# activities imported from files by saros-fit-import.py have negative ids and are not in the overview, a fresh
+# instance gets them from the copy in the s3 bucket
+if not os.path.exists('activities_activity.pkl'):
+    try:
+        cli.download_file(
+            Bucket='sarosfit',
+            Key='data/activities_activity.pkl',
+            Filename='activities_activity.pkl')
+    except:
+        pass
+
+try:
+    activities_imported = pd.read_pickle('activities_activity.pkl')
+    activities_activity = pd.concat([activities_activity, activities_imported[activities_imported.index < 0]])
+except:
+    pass
+
+activities_activity.to_pickle('activities_activity.pkl')
+
 # (https://faun.pub/write-files-from-ec2-to-s3-in-aws-programmatically-716d1a4ef639)
-cli.put_object(
-  Body='activities_overview.csv',
+cli.upload_file(
+  Filename='activities_overview.csv',
   Bucket='sarosfit',
   Key='data/activities_overview.csv')
 
+cli.upload_file(
+  Filename=sync_file,
+  Bucket='sarosfit',
+  Key='data/activities_overview_sync.json')
+
 print("OVERVIEW FILE UPDATED IN S3 BUCKET\n")
 
 # ## Create Dataframe with DETAILED ACTIVITY DATA Streams for New Activities *(Strava API)*
@@ -195,9 +345,9 @@ def activity_streams(id):
                     'moving','grade_smooth']
     streams_text = 'time,distance,latlng,altitude,velocity_smooth,heartrate,cadence,watts,temp,moving,grade_smooth'
 
-    a_json = pd.json_normalize(requests.get(a_url + str(id) + '/streams?access_token=' + access_token + 
-                                             '&keys=time,distance,latlng,altitude,velocity_smooth,heartrate,cadence,watts,temp,moving,grade_smooth' + 
-                                             '&key_by_type=true').json())
+    a_json = pd.json_normalize(track_rate(requests.get(a_url + str(id) + '/streams?access_token=' + access_token +
+                                             '&keys=time,distance,latlng,altitude,velocity_smooth,heartrate,cadence,watts,temp,moving,grade_smooth' +
+                                             '&key_by_type=true')).json())
 
     for a in range(0,len(streams_list)):
         try:
@@ -205,12 +355,9 @@ def activity_streams(id):
         except:
             a_df[streams_list[a]] = np.nan
 
+    # each row is one sample, keyed by (id, sample), the activity's date, name and type are in activities_activity
     a_df['id'] = id
-    idx = activities_overview.index[activities_overview['id'] == id].tolist()[0]
-
-    a_df['date'] = activities_overview['start_date_local'][idx]
-    a_df['name'] = activities_overview['name'][idx]
-    a_df['type'] = activities_overview['type'][idx]
+    a_df['sample'] = range(len(a_df))
 
     return a_df
 
@@ -221,16 +368,33 @@ try:
     activities_details = pd.read_pickle('activities_details.pkl')
 except:
     try:
-        # Check the s3 bucket to see if there is a file
+        # Check the s3 bucket to see if there is a file (kept there in the compact format from saros-fit-codec.py)
         cli.download_file(
             Bucket='sarosfit',
-            Key='data/activities_details.pkl',
-            Filename='activities_details.pkl')
+            Key='data/activities_details.sfc',
+            Filename='activities_details.sfc')
+
+        subprocess.run([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'saros-fit-codec.py'),
+                        'decode'], check=True)
 
         activities_details = pd.read_pickle('activities_details.pkl')
     except:
-        # Create a new empty dataframe (usually because first run)
-        activities_details = pd.DataFrame()
+        try:
+            # Files uploaded before the compact format was used
+            cli.download_file(
+                Bucket='sarosfit',
+                Key='data/activities_details.pkl',
+                Filename='activities_details.pkl')
+
+            activities_details = pd.read_pickle('activities_details.pkl')
+        except:
+            # Create a new empty dataframe (usually because first run)
+            activities_details = pd.DataFrame()
+
+# details downloaded before the activity table copied the date, name and type onto every row
+activities_details = activities_details.drop(columns=['date', 'name', 'type'], errors='ignore')
+if 'id' in activities_details.columns and 'sample' not in activities_details.columns:
+    activities_details['sample'] = activities_details.groupby('id').cumcount()
 
 # activities_details.info()
 # activities_details.tail()
@@ -239,6 +403,12 @@ except:
 # ### Download only Details for New Activities
 # (https://thispointer.com/pandas-check-if-a-value-exists-in-a-dataframe-using-in-not-in-operator-isin/)
 
+# activities deleted on Strava only drop out of the overview on a full sync (imported activities have negative ids)
+if full_sync and 'id' in activities_details.columns:
+    activities_details = activities_details[activities_details['id'].isin(activities_overview['id']) |
+                                            (activities_details['id'] < 0)]
+    activities_details = activities_details.reset_index(drop=True)
+
 a_details_to_import = []
 try:
     a_already_downloaded = activities_details['id'].unique()
@@ -265,28 +435,33 @@ print("Number of Activities to Import:  " + str(len(a_details_to_import)))
 # Activities that have no details will always show up because they will never have any details added
 # a_details_to_import
 
-a_range_l = 0
-a_range_h = 89
-a_number = len(a_details_to_import)
+# activities left over from a run that ran out of rate limit go first
+a_pending = set(jobs['pending'])
+a_details_to_import = ([a for a in a_details_to_import if a in a_pending] +
+                       [a for a in a_details_to_import if a not in a_pending])
+
+a_downloaded = 0
 
-while a_range_l < a_number:
-    if a_range_l > 0:
-        print('Waiting...')
-        # wait a little over 16m40s to be safe (100 requests per 15min limit)
-        time.sleep(1000)
+for a in a_details_to_import:
+    if rate_exhausted():
+        break
 
-    print('Downloading activities ' + str(a_range_l) + ' to ' + str(a_range_h) +' ...')
+    print('Downloading activity ', a)
+    a_df_curr = activity_streams(a)
+    activities_details = pd.concat([activities_details, a_df_curr], ignore_index=True)
+    a_downloaded += 1
 
-    for a in a_details_to_import[a_range_l:a_range_h]:
-        print('Downloading activity ', a)
-        a_df_curr = activity_streams(a)
-        activities_details = activities_details.append(a_df_curr, ignore_index=True) 
+jobs['pending'] = [int(a) for a in a_details_to_import[a_downloaded:]]
 
-    # 90 rather than 100 to be safe
-    a_range_l = a_range_l + 90
-    a_range_h = a_range_h + 90
+if jobs['pending']:
+    # save what was downloaded and leave the rest for the first scheduled run after the limit resets
+    jobs['resume_after'] = rate_reset()
+    print('Rate limit reached, ' + str(len(jobs['pending'])) + ' activities left until ' +
+          str(pd.Timestamp(jobs['resume_after'], unit='s')) + ' UTC')
+else:
+    jobs['resume_after'] = 0
 
-print('Done getting details for all new activities.\n')
+print('Done getting details for ' + str(a_downloaded) + ' new activities.\n')
 
 # print(activities_details.head(2))
 # print(activities_details.tail(2))
@@ -304,16 +479,45 @@ activities_details.to_csv('activities_details.csv', header=True)
 
 print("\nDETAILED CSV and PKL FILES UPDATED\n")
 
-cli.put_object(
-  Body='activities_details.csv',
-  Bucket='sarosfit',
-  Key='data/activities_details.csv')
+# ## Update Files Built from the Activity Details
+# each one is a separate script so it can also be run on its own, the files they write are kept in s3 so a fresh
+# instance only builds them for new activities.  The details themselves go to s3 as activities_details.sfc, an
+# order of magnitude smaller than the pkl or csv, with the date, name and type of each activity in
+# activities_activity.pkl.
+post_sync_scripts = ['saros-fit-codec.py', 'saros-fit-pyramid.py', 'saros-fit-best-efforts.py',
+                     'saros-fit-rollups.py']
+post_sync_files = ['activities_details.sfc', 'activities_activity.pkl', 'activities_pyramid.sfp',
+                   'activities_best_efforts.pkl', 'activities_rollups.pkl']
+
+for f in post_sync_files:
+    if not os.path.exists(f):
+        try:
+            cli.download_file(
+                Bucket='sarosfit',
+                Key='data/' + f,
+                Filename=f)
+        except:
+            pass
 
-cli.put_object(
-  Body='activities_details.pkl',
-  Bucket='sarosfit',
-  Key='data/activities_details.pkl')
+for s in post_sync_scripts:
+    print("Running " + s)
+    subprocess.run([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), s)])
+
+for f in post_sync_files:
+    cli.upload_file(
+        Filename=f,
+        Bucket='sarosfit',
+        Key='data/' + f)
+
+print("DETAILED AND DERIVED FILES UPDATED IN S3 BUCKET\n")
+
+# only record the pending work once the files it follows on from are saved
+with open(jobs_file, 'w') as f:
+    json.dump(jobs, f)
 
-print("DETAILED FILES UPDATED IN S3 BUCKET\n")
+cli.upload_file(
+    Filename=jobs_file,
+    Bucket='sarosfit',
+    Key='data/' + jobs_file)
 
 print("EXITING SAROS FIT\n")
\ No newline at end of file
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# coding: utf-8
+# ---
+# # Best Efforts -- Fastest Time over Fixed Distances
+#
+# rolling-maxes.py finds the best power, heartrate, etc. over fixed durations.  For running what matters is the
+# fastest time over fixed distances (400m, 1k, 5k, 10k, half and full marathon).  For every start sample the end of
+# the fastest segment is found with a binary search (searchsorted) on the distance stream, so each distance is one
+# vectorized pass over the activity.  The end time is interpolated between samples so the distance is exact.
+#
+# Results for every activity are kept in activities_best_efforts.pkl, so running the script again only looks at
+# activities that are new since the last run, or whose streams were downloaded again.  Activities whose type is no
+# longer a run are dropped.  The sync scripts run it after the details are updated.
+# ---
+
+# import libraries
+import numpy as np
+import pandas as pd
+
+best_efforts_file = 'activities_best_efforts.pkl'
+
+# distances in metres
+best_effort_distances = {
+    '400m': 400,
+    '1k': 1000,
+    '1 mile': 1609.34,
+    '5k': 5000,
+    '10k': 10000,
+    'Half-Marathon': 21097.5,
+    'Marathon': 42195,
+}
+
+best_effort_types = ['Run', 'TrailRun', 'VirtualRun']
+
+best_effort_columns = ['id', 'samples', 'distance', 'metres', 'seconds', 'start_time', 'end_time']
+
+
+# ## Fastest Segment over Each Distance
+def best_efforts(time, distance):
+    efforts = []
+
+    keep = ~(np.isnan(time) | np.isnan(distance))
+    t = time[keep]
+    # a gps glitch can make distance go backwards for a sample, which would break the binary search
+    d = np.maximum.accumulate(distance[keep])
+
+    for name, target in best_effort_distances.items():
+        effort = {'distance': name, 'metres': target, 'seconds': np.nan, 'start_time': np.nan, 'end_time': np.nan}
+
+        if len(d) > 1 and d[-1] - d[0] >= target:
+            # first sample at or beyond target metres from each start sample
+            end = np.searchsorted(d, d + target, side='left')
+            start = np.nonzero(end < len(d))[0]
+            end = end[start]
+
+            # time at exactly target metres, between the sample before end and end
+            prev = np.maximum(end - 1, start)
+            step = d[end] - d[prev]
+            frac = np.where(step > 0, (d[start] + target - d[prev]) / np.where(step > 0, step, 1), 1)
+            t_end = t[prev] + frac * (t[end] - t[prev])
+
+            seconds = t_end - t[start]
+            best = np.argmin(seconds)
+
+            effort['seconds'] = seconds[best]
+            effort['start_time'] = t[start[best]]
+            effort['end_time'] = t_end[best]
+
+        efforts.append(effort)
+
+    return efforts
+
+
+# ## Personal Records
+# fastest effort at each distance across all activities
+def personal_records(efforts, activity):
+    efforts = efforts.dropna(subset=['seconds'])
+    records = efforts.loc[efforts.groupby('distance')['seconds'].idxmin()]
+
+    records = records.join(activity[['name', 'date']], on='id')
+    records['pace (min/km)'] = records['seconds'] / 60 / (records['metres'] / 1000)
+    records['time'] = pd.to_timedelta(records['seconds'].round(), unit='s')
+
+    return records.sort_values(by='metres')[['distance', 'time', 'pace (min/km)', 'name', 'date', 'id']]
+
+
+if __name__ == '__main__':
+    # date, name and type of every activity, including ones imported from files
+    activities_activity = pd.read_pickle('activities_activity.pkl')
+    activities_details = pd.read_pickle('activities_details.pkl')
+
+    try:
+        # files written before the sample count was kept are searched again
+        activities_best_efforts = pd.read_pickle(best_efforts_file).reindex(columns=best_effort_columns)
+    except:
+        activities_best_efforts = pd.DataFrame(columns=best_effort_columns)
+
+    # ### Best Efforts only for New Runs (or runs whose streams were downloaded again)
+    runs = activities_activity.index[activities_activity['type'].isin(best_effort_types)]
+    samples = activities_details.groupby('id').size()
+
+    # activities deleted from the details, changed to another type or with a different number of samples
+    current = activities_best_efforts['id'].isin(runs) & \
+        (activities_best_efforts['samples'] == activities_best_efforts['id'].map(samples))
+    activities_best_efforts = activities_best_efforts[current]
+
+    a_to_search = np.setdiff1d(np.intersect1d(runs, samples.index), activities_best_efforts['id'].unique())
+
+    print("Number of Runs to Search for Best Efforts:  " + str(len(a_to_search)))
+
+    a_details = activities_details.loc[activities_details['id'].isin(a_to_search), ['id', 'time', 'distance']]
+    a_efforts = []
+
+    for a, a_df in a_details.groupby('id'):
+        for effort in best_efforts(pd.to_numeric(a_df['time'], errors='coerce').to_numpy(dtype=float),
+                                   pd.to_numeric(a_df['distance'], errors='coerce').to_numpy(dtype=float)):
+            effort['id'] = a
+            effort['samples'] = len(a_df)
+            a_efforts.append(effort)
+
+    if a_efforts:
+        activities_best_efforts = pd.concat([activities_best_efforts, pd.DataFrame(a_efforts)], ignore_index=True)
+
+    activities_best_efforts.to_pickle(best_efforts_file)
+
+    print("BEST EFFORTS PKL FILE UPDATED\n")
+
+    print("PERSONAL RECORDS\n")
+    print(personal_records(activities_best_efforts, activities_activity).to_string(index=False))
+    print("")
@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+# coding: utf-8
+# ---
+# # Compact Binary File for Activity Streams
+#
+# Most streams change by a small, regular step from one sample to the next (time goes up by 1, distance by a few
+# metres), so storing the differences instead of the values and compressing them is far smaller than the float64
+# columns in activities_details.pkl or the decimal text in activities_details.csv.  Each stream of each activity is:
+#    - time, distance:             delta-of-delta encoded
+#    - latlng, altitude, others:   fixed point (to the precision Strava sends) and delta encoded
+#    - moving:                     bit packed
+# then narrowed to the smallest integer type that fits and compressed with zlib.
+#
+# activities_details.sfc starts with a json header holding the offset of every stream, so one activity or one
+# stream can be decoded without reading the rest.  Decoding maps the file into memory and goes straight into numpy
+# arrays with frombuffer.
+#
+#   python saros-fit-codec.py            activities_details.pkl -> activities_details.sfc
+#   python saros-fit-codec.py decode     activities_details.sfc -> activities_details.pkl
+#
+# From a notebook:
+#   import importlib
+#   codec = importlib.import_module('saros-fit-codec')
+#   activities_details = codec.read_streams(ids=[4998708851], columns=['time', 'watts'])
+# ---
+
+# import libraries
+import numpy as np
+import pandas as pd
+
+import sys
+import json
+import struct
+import zlib
+
+codec_file = 'activities_details.sfc'
+codec_magic = b'SFC1'
+
+# (codec, fixed point scale) for each stream, latlng is split into lat and lng
+stream_codecs = {
+    'time':            ('dod', 1),
+    'distance':        ('dod', 10),
+    'lat':             ('delta', 1000000),
+    'lng':             ('delta', 1000000),
+    'altitude':        ('delta', 10),
+    'velocity_smooth': ('delta', 1000),
+    'heartrate':       ('delta', 1),
+    'cadence':         ('delta', 1),
+    'watts':           ('delta', 1),
+    'temp':            ('delta', 1),
+    'moving':          ('bits', 1),
+    'grade_smooth':    ('delta', 10),
+}
+
+streams_list = ['time','distance','latlng','altitude','velocity_smooth','heartrate','cadence','watts','temp',
+                'moving','grade_smooth']
+
+
+# ## Encode
+# smallest integer type that holds every value
+def narrow(q):
+    for dtype in (np.int8, np.int16, np.int32):
+        info = np.iinfo(dtype)
+        if len(q) == 0 or (q.min() >= info.min and q.max() <= info.max):
+            return q.astype(dtype)
+    return q.astype(np.int64)
+
+
+def encode_stream(values, codec, scale):
+    nulls = np.isnan(values)
+
+    # gaps take the previous value so they do not break up the differences, the null mask puts them back
+    if nulls.any():
+        values = pd.Series(values).ffill().bfill().to_numpy()
+
+    if codec == 'bits':
+        data = np.packbits(values.astype(bool))
+    else:
+        q = np.round(values * scale).astype(np.int64)
+        data = np.diff(q, prepend=0)
+        if codec == 'dod':
+            data = np.diff(data, prepend=0)
+        data = narrow(data)
+
+    info = {'codec': codec, 'scale': scale, 'dtype': data.dtype.str}
+    blobs = [zlib.compress(data.tobytes(), 9)]
+
+    if nulls.any():
+        info['nulls'] = True
+        blobs.append(zlib.compress(np.packbits(nulls).tobytes(), 9))
+
+    return info, blobs
+
+
+# latlng comes back from Strava as [lat, lng] lists, the aws script stores it as the text of that list
+def split_latlng(latlng):
+    lat = np.full(len(latlng), np.nan)
+    lng = np.full(len(latlng), np.nan)
+
+    for i, p in enumerate(latlng):
+        if isinstance(p, str) and p.startswith('['):
+            p = json.loads(p)
+        if isinstance(p, (list, tuple, np.ndarray)) and len(p) == 2:
+            lat[i], lng[i] = p
+
+    return lat, lng
+
+
+def encode_activity(a_df):
+    columns = {}
+
+    for s in streams_list:
+        if s not in a_df.columns:
+            continue
+
+        if s == 'latlng':
+            lat, lng = split_latlng(a_df[s].tolist())
+            columns['lat'], columns['lng'] = lat, lng
+        elif s == 'moving':
+            moving = a_df[s].map({True: 1.0, False: 0.0, 'True': 1.0, 'False': 0.0}).astype(float)
+            columns[s] = moving.to_numpy()
+        else:
+            columns[s] = pd.to_numeric(a_df[s], errors='coerce').to_numpy(dtype=float)
+
+    a_streams = {}
+    a_blobs = []
+
+    for s, values in columns.items():
+        # stream not recorded for this activity
+        if np.isnan(values).all():
+            continue
+        codec, scale = stream_codecs[s]
+        a_streams[s], blobs = encode_stream(values, codec, scale)
+        a_blobs.append((s, blobs))
+
+    return a_streams, a_blobs
+
+
+def write_streams(activities_details, filename=codec_file):
+    header = {'streams': streams_list, 'activities': []}
+    body = []
+    offset = 0
+
+    for a, a_df in activities_details.groupby('id', sort=False):
+        a_streams, a_blobs = encode_activity(a_df)
+
+        for s, blobs in a_blobs:
+            a_streams[s]['blobs'] = []
+            for b in blobs:
+                a_streams[s]['blobs'].append([offset, len(b)])
+                body.append(b)
+                offset += len(b)
+
+        header['activities'].append({'id': int(a), 'samples': len(a_df), 'streams': a_streams})
+
+    header = json.dumps(header).encode('utf-8')
+
+    with open(filename, 'wb') as f:
+        f.write(codec_magic)
+        f.write(struct.pack('<Q', len(header)))
+        f.write(header)
+        for b in body:
+            f.write(b)
+
+
+# ## Decode
+def read_header(filename=codec_file):
+    with open(filename, 'rb') as f:
+        if f.read(4) != codec_magic:
+            raise ValueError(filename + ' is not an activity stream file')
+        length = struct.unpack('<Q', f.read(8))[0]
+        header = json.loads(f.read(length))
+
+    return header, 12 + length
+
+
+def decode_stream(buffer, start, info, samples):
+    offset, length = info['blobs'][0]
+    raw = zlib.decompress(buffer[start + offset:start + offset + length])
+
+    if info['codec'] == 'bits':
+        values = np.unpackbits(np.frombuffer(raw, dtype=np.uint8))[:samples].astype(bool)
+    else:
+        data = np.frombuffer(raw, dtype=np.dtype(info['dtype'])).astype(np.int64)
+        if info['codec'] == 'dod':
+            data = np.cumsum(data)
+        values = np.cumsum(data) / info['scale']
+
+    if info.get('nulls'):
+        offset, length = info['blobs'][1]
+        nulls = np.unpackbits(np.frombuffer(zlib.decompress(buffer[start + offset:start + offset + length]),
+                                            dtype=np.uint8))[:samples].astype(bool)
+        values = values.astype(object if values.dtype == bool else float)
+        values[nulls] = np.nan
+
+    return values
+
+
+# decode only the activities and streams asked for (all of them by default), the date, name and type of each activity
+# are in activities_activity.pkl (files written before it also hold them in the header, they are not read back)
+def read_streams(filename=codec_file, ids=None, columns=None):
+    header, start = read_header(filename)
+    buffer = memoryview(np.memmap(filename, dtype=np.uint8, mode='r'))
+
+    if columns is None:
+        columns = header['streams']
+    if ids is not None:
+        ids = set(int(a) for a in ids)
+
+    a_dfs = []
+
+    for activity in header['activities']:
+        if ids is not None and activity['id'] not in ids:
+            continue
+
+        n = activity['samples']
+        a_streams = activity['streams']
+        a_df = pd.DataFrame(index=range(n))
+
+        for s in columns:
+            if s == 'latlng':
+                if 'lat' in a_streams:
+                    lat = decode_stream(buffer, start, a_streams['lat'], n)
+                    lng = decode_stream(buffer, start, a_streams['lng'], n)
+                    latlng = pd.Series(np.column_stack([lat, lng]).tolist(), dtype=object)
+                    latlng[np.isnan(lat)] = np.nan
+                    a_df[s] = latlng
+                else:
+                    a_df[s] = np.nan
+            elif s in a_streams:
+                a_df[s] = decode_stream(buffer, start, a_streams[s], n)
+            else:
+                a_df[s] = np.nan
+
+        a_df['id'] = activity['id']
+        a_df['sample'] = range(n)
+
+        a_dfs.append(a_df)
+
+    if not a_dfs:
+        return pd.DataFrame(columns=columns + ['id', 'sample'])
+
+    return pd.concat(a_dfs, ignore_index=True)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'decode':
+        activities_details = read_streams()
+        activities_details.to_pickle('activities_details.pkl')
+
+        print("DETAILED PKL FILE DECODED FROM " + codec_file + "\n")
+
+    else:
+        activities_details = pd.read_pickle('activities_details.pkl')
+        write_streams(activities_details)
+
+        print("STREAMS FILE " + codec_file + " UPDATED\n")
@@ -0,0 +1,324 @@
+#!/usr/bin/env python
+# coding: utf-8
+# ---
+# # Import Activity Files (GoldenCheetah CSV, FIT, GPX, TCX) into the Activity Details
+#
+# Years of activities recorded before Strava, or already exported from a head unit, would take days of Strava API
+# requests to download again.  This script reads them straight from a folder instead:
+#    - every file is parsed in a separate process (one per core)
+#    - the channels of each format are mapped onto the same 11 streams activity_streams downloads from Strava
+#    - files that start within a minute of an activity already downloaded from Strava are skipped
+#    - imported activities get a negative id (minus the start time in seconds) so they never clash with Strava ids
+#      and importing the same folder again skips them
+#
+# The streams are added to activities_details.pkl and the date, name and type to activities_activity.pkl.  As for
+# Strava activities the date is the local time of the start.  GPX and TCX files only have UTC times, so their date is
+# the UTC start and date_is_utc is True (it is only set for imported files).  The UTC start of every file that has
+# one is also kept in start_date_utc.
+#
+#   python saros-fit-import.py ../Golden-Cheetah
+#
+# FIT files need fitparse (pip install fitparse), they are skipped without it.
+# ---
+
+# import libraries
+import numpy as np
+import pandas as pd
+
+import os
+import sys
+import subprocess
+import glob
+import datetime
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from fitparse import FitFile # (http://johannesjacob.com/2019/03/13/analyze-your-cycling-data-python/)
+except ImportError:
+    FitFile = None
+
+import_folder = sys.argv[1] if len(sys.argv) > 1 else '../Golden-Cheetah'
+
+streams_list = ['time','distance','latlng','altitude','velocity_smooth','heartrate','cadence','watts','temp',
+                'moving','grade_smooth']
+
+post_sync_scripts = ['saros-fit-codec.py', 'saros-fit-pyramid.py', 'saros-fit-best-efforts.py']
+
+# FIT times are seconds since 1989-12-31 00:00
+fit_epoch = datetime.datetime(1989, 12, 31)
+
+# files starting this many seconds from a Strava activity are the same activity
+duplicate_seconds = 60
+
+sport_types = {
+    'running': 'Run', 'run': 'Run',
+    'cycling': 'Ride', 'biking': 'Ride', 'ride': 'Ride',
+    'walking': 'Walk', 'walk': 'Walk',
+    'hiking': 'Hike', 'hike': 'Hike',
+    'swimming': 'Swim', 'swim': 'Swim',
+}
+
+
+# ## Map Each Format onto the Strava Streams
+# distance between consecutive points in metres (https://en.wikipedia.org/wiki/Haversine_formula)
+def haversine(lat, lng):
+    lat, lng = np.radians(lat), np.radians(lng)
+    a = np.sin(np.diff(lat) / 2) ** 2 + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(np.diff(lng) / 2) ** 2
+    return np.concatenate([[0], 2 * 6371000 * np.arcsin(np.sqrt(a))])
+
+
+# columns time (s), distance (m), lat, lng, altitude, speed (m/s), heartrate, cadence, watts, temp, grade; any may be
+# missing and are filled in from the others where possible
+def to_streams(df):
+    df = df.reset_index(drop=True)
+    a_df = pd.DataFrame(index=df.index)
+
+    has_position = 'lat' in df.columns and df['lat'].notna().any()
+
+    if 'distance' not in df.columns and has_position:
+        df['distance'] = np.nancumsum(haversine(df['lat'].to_numpy(dtype=float), df['lng'].to_numpy(dtype=float)))
+    if 'speed' not in df.columns and 'distance' in df.columns:
+        df['speed'] = (df['distance'].diff() / df['time'].diff()).fillna(0)
+    if 'grade' not in df.columns and 'distance' in df.columns and 'altitude' in df.columns:
+        step = df['distance'].diff()
+        df['grade'] = (100 * df['altitude'].diff() / step.where(step > 0)).fillna(0).round(1)
+
+    a_df['time'] = df['time']
+    a_df['distance'] = df['distance'] if 'distance' in df.columns else np.nan
+    if has_position:
+        a_df['latlng'] = [np.nan if np.isnan(y) else [y, x] for y, x in zip(df['lat'], df['lng'])]
+    else:
+        a_df['latlng'] = np.nan
+    a_df['altitude'] = df['altitude'] if 'altitude' in df.columns else np.nan
+    a_df['velocity_smooth'] = df['speed'] if 'speed' in df.columns else np.nan
+    for s, c in (('heartrate', 'heartrate'), ('cadence', 'cadence'), ('watts', 'watts'), ('temp', 'temp')):
+        a_df[s] = df[c] if c in df.columns else np.nan
+    a_df['moving'] = df['speed'] > 0.5 if 'speed' in df.columns else np.nan
+    a_df['grade_smooth'] = df['grade'] if 'grade' in df.columns else np.nan
+
+    return a_df[streams_list]
+
+
+# GoldenCheetah exports have no start time inside the file, it is in the file name (local time)
+def parse_goldencheetah(filename):
+    df = pd.read_csv(filename)
+    start = pd.to_datetime(os.path.basename(filename)[:19], format='%Y_%m_%d_%H_%M_%S')
+
+    gc = pd.DataFrame({'time': df['secs']})
+    if 'km' in df.columns:
+        gc['distance'] = df['km'] * 1000
+    if 'lat' in df.columns and (df['lat'] != 0).any():
+        gc['lat'] = df['lat'].where(df['lat'] != 0)
+        gc['lng'] = df['lon'].where(df['lat'] != 0)
+    for c, g in (('altitude', 'alt'), ('heartrate', 'hr'), ('cadence', 'cad'), ('watts', 'watts'),
+                 ('temp', 'temp'), ('grade', 'slope')):
+        if g in df.columns:
+            gc[c] = df[g]
+    if 'kph' in df.columns:
+        gc['speed'] = df['kph'] / 3.6
+    # GoldenCheetah writes -255 when there is no temperature sensor
+    if 'temp' in gc.columns:
+        gc['temp'] = gc['temp'].where(gc['temp'] > -255)
+
+    # GoldenCheetah is mostly used for cycling and the csv does not say what the sport was
+    return None, start, 'Ride', gc
+
+
+def strip_namespace(root):
+    for e in root.iter():
+        if '}' in e.tag:
+            e.tag = e.tag.split('}', 1)[1]
+    return root
+
+
+def parse_gpx(filename):
+    root = strip_namespace(ET.parse(filename).getroot())
+    points = []
+
+    for p in root.iter('trkpt'):
+        point = {'timestamp': p.findtext('time'), 'lat': float(p.get('lat')), 'lng': float(p.get('lon'))}
+        for c, tag in (('altitude', 'ele'), ('heartrate', 'hr'), ('cadence', 'cad'), ('temp', 'atemp'),
+                       ('watts', 'power')):
+            e = p.find('.//' + tag)
+            if e is not None and e.text:
+                point[c] = float(e.text)
+        points.append(point)
+
+    df = pd.DataFrame(points)
+    df['timestamp'] = pd.to_datetime(df['timestamp'], utc=True)
+    df['time'] = (df['timestamp'] - df['timestamp'][0]).dt.total_seconds()
+
+    sport = (root.findtext('.//trk/type') or '').lower()
+    return df['timestamp'][0], None, sport_types.get(sport, 'Workout'), df.drop(columns='timestamp')
+
+
+def parse_tcx(filename):
+    root = strip_namespace(ET.parse(filename).getroot())
+    points = []
+
+    for p in root.iter('Trackpoint'):
+        point = {'timestamp': p.findtext('Time')}
+        for c, tag in (('lat', 'Position/LatitudeDegrees'), ('lng', 'Position/LongitudeDegrees'),
+                       ('altitude', 'AltitudeMeters'), ('distance', 'DistanceMeters'),
+                       ('heartrate', 'HeartRateBpm/Value'), ('cadence', 'Cadence'), ('watts', './/Watts'),
+                       ('speed', './/Speed')):
+            text = p.findtext(tag)
+            if text:
+                point[c] = float(text)
+        points.append(point)
+
+    df = pd.DataFrame(points)
+    df['timestamp'] = pd.to_datetime(df['timestamp'], utc=True)
+    df['time'] = (df['timestamp'] - df['timestamp'][0]).dt.total_seconds()
+
+    activity = root.find('.//Activity')
+    sport = (activity.get('Sport') if activity is not None else '') or ''
+    return df['timestamp'][0], None, sport_types.get(sport.lower(), 'Workout'), df.drop(columns='timestamp')
+
+
+def parse_fit(filename):
+    fit = FitFile(filename)
+    points = []
+
+    for record in fit.get_messages('record'):
+        r = record.get_values()
+        point = {
+            'timestamp': r.get('timestamp'),
+            # positions are stored in semicircles
+            'lat': r['position_lat'] * 180 / 2 ** 31 if r.get('position_lat') is not None else np.nan,
+            'lng': r['position_long'] * 180 / 2 ** 31 if r.get('position_long') is not None else np.nan,
+            'altitude': r.get('enhanced_altitude', r.get('altitude')),
+            'distance': r.get('distance'),
+            'speed': r.get('enhanced_speed', r.get('speed')),
+            'heartrate': r.get('heart_rate'),
+            'cadence': r.get('cadence'),
+            'watts': r.get('power'),
+            'temp': r.get('temperature'),
+        }
+        points.append(point)
+
+    df = pd.DataFrame(points).dropna(subset=['timestamp']).dropna(axis=1, how='all').reset_index(drop=True)
+    df['timestamp'] = pd.to_datetime(df['timestamp'], utc=True)
+    df['time'] = (df['timestamp'] - df['timestamp'][0]).dt.total_seconds()
+
+    sport = ''
+    for s in fit.get_messages('sport'):
+        sport = str(s.get_value('sport') or '')
+
+    # the activity message has the same moment in UTC and local time, the difference is the time zone offset
+    start_local = None
+    for a in fit.get_messages('activity'):
+        utc, local = a.get_value('timestamp'), a.get_value('local_timestamp')
+        if utc is not None and local is not None:
+            if not isinstance(local, datetime.datetime):
+                local = fit_epoch + datetime.timedelta(seconds=local)
+            offset = pd.Timestamp(local) - pd.Timestamp(utc).tz_localize(None)
+            start_local = df['timestamp'][0].tz_localize(None) + offset.round('min')
+
+    return df['timestamp'][0], start_local, sport_types.get(sport.lower(), 'Workout'), df.drop(columns='timestamp')
+
+
+parsers = {'.csv': parse_goldencheetah, '.gpx': parse_gpx, '.tcx': parse_tcx, '.fit': parse_fit}
+
+
+# runs in the process pool, a file that cannot be read is reported and skipped rather than stopping the import
+def parse_file(filename):
+    try:
+        start_utc, start_local, sport, df = parsers[os.path.splitext(filename)[1].lower()](filename)
+        return filename, start_utc, start_local, sport, to_streams(df.sort_values(by='time'))
+    except Exception as e:
+        print('Could not read ' + filename + ': ' + str(e))
+        return filename, None, None, None, None
+
+
+if __name__ == '__main__':
+    # ### Files to Import
+    files = [f for f in sorted(glob.glob(os.path.join(import_folder, '*')))
+             if os.path.splitext(f)[1].lower() in parsers]
+
+    if FitFile is None and any(f.lower().endswith('.fit') for f in files):
+        print("fitparse is not installed, skipping FIT files (pip install fitparse)")
+        files = [f for f in files if not f.lower().endswith('.fit')]
+
+    print("Number of Files Found:  " + str(len(files)))
+
+    # ### Load Already Downloaded Activities
+    try:
+        activities_overview = pd.read_csv('activities_overview.csv', index_col=0)
+    except:
+        activities_overview = pd.DataFrame(columns=['id', 'start_date', 'start_date_local'])
+
+    try:
+        activities_details = pd.read_pickle('activities_details.pkl')
+    except:
+        activities_details = pd.DataFrame()
+
+    try:
+        activities_activity = pd.read_pickle('activities_activity.pkl')
+    except:
+        activities_activity = pd.DataFrame(columns=['date', 'name', 'type', 'start_date_utc', 'date_is_utc'])
+
+    # start times of the Strava activities, in UTC and in the athlete's local time
+    strava_starts = {
+        'utc': pd.to_datetime(activities_overview['start_date'], utc=True).dt.tz_localize(None).to_numpy(),
+        'local': pd.to_datetime(activities_overview['start_date_local'], utc=True).dt.tz_localize(None).to_numpy(),
+    }
+
+    # ### Parse the Files in Parallel
+    a_imported = []
+    a_activity = []
+    a_skipped = 0
+
+    with ProcessPoolExecutor() as pool:
+        for filename, start_utc, start_local, sport, a_df in pool.map(parse_file, files, chunksize=4):
+            if a_df is None or a_df.empty:
+                continue
+
+            starts = {}
+            for zone, start in (('utc', start_utc), ('local', start_local)):
+                if start is not None:
+                    start = pd.Timestamp(start)
+                    starts[zone] = start.tz_localize(None) if start.tzinfo else start
+
+            # the UTC start when the file has one, so importing the same files again gives the same ids
+            id = -int(starts.get('utc', starts.get('local')).timestamp())
+
+            already_strava = any(len(strava_starts[zone]) > 0 and
+                                 np.abs(strava_starts[zone] - start.to_datetime64()).min() <=
+                                 np.timedelta64(duplicate_seconds, 's') for zone, start in starts.items())
+
+            if already_strava or id in activities_activity.index or any(a['id'] == id for a in a_activity):
+                a_skipped += 1
+                continue
+
+            a_df['id'] = id
+            a_df['sample'] = range(len(a_df))
+            a_imported.append(a_df)
+
+            # same format as Strava's start_date_local, which ends in Z even though it is local time, files with no
+            # local time fall back to the UTC start so they still sort and filter by date
+            a_activity.append({'id': id,
+                               'date': starts.get('local', starts.get('utc')).strftime('%Y-%m-%dT%H:%M:%SZ'),
+                               'name': os.path.splitext(os.path.basename(filename))[0], 'type': sport,
+                               'start_date_utc': starts['utc'].strftime('%Y-%m-%dT%H:%M:%SZ') if 'utc' in starts
+                               else np.nan,
+                               'date_is_utc': 'local' not in starts})
+
+    print("Number of Files Already Downloaded or Imported:  " + str(a_skipped))
+    print("Number of Activities Imported:  " + str(len(a_imported)))
+
+    if a_imported:
+        activities_details = pd.concat([activities_details] + a_imported, ignore_index=True)
+        activities_activity = pd.concat([activities_activity, pd.DataFrame(a_activity).set_index('id')])
+
+        activities_details.to_pickle('activities_details.pkl')
+        activities_details.to_csv('activities_details.csv', header=True)
+        activities_activity.to_pickle('activities_activity.pkl')
+
+        print("\nDETAILED CSV and PKL FILES UPDATED\n")
+
+        # ### Update Files Built from the Activity Details
+        for s in post_sync_scripts:
+            print("Running " + s)
+            subprocess.run([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), s)])
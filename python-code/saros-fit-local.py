@@ -49,6 +49,7 @@ import subprocess
 import pathlib
 from dotenv import load_dotenv
 
+import json
 import codecs
 from codecs import open
 from datetime import date
@@ -82,20 +83,49 @@ print("")
 
 # ## Create Dataframe with Summary Info for All Activities *(Strava API)*
 # (http://www.hainke.ca/index.php/2018/08/23/using-the-strava-api-to-retrieve-activity-data/)
-# Initialize the dataframe
-activities_overview = pd.DataFrame()
+# Only activities that started after the newest one already in activities_overview.csv are requested.  The start
+# time and id of the newest activity are kept in activities_overview_sync.json.  Every full_sync_days the whole
+# list is downloaded again to pick up edited and deleted activities.
+full_sync_days = 7
+sync_file = 'activities_overview_sync.json'
+
+try:
+    activities_overview = pd.read_csv('activities_overview.csv', index_col=0)
+except:
+    activities_overview = pd.DataFrame()
+
+try:
+    with open(sync_file, 'r') as f:
+        overview_sync = json.load(f)
+except:
+    overview_sync = {}
+
+full_sync = (activities_overview.empty or 'after' not in overview_sync or
+             time.time() - overview_sync.get('last_full_sync', 0) > full_sync_days * 86400)
+
+# Initialize the dataframe for the activities downloaded in this run
+activities_new = pd.DataFrame()
 
 url = "https://www.strava.com/api/v3/athlete/activities"
 page = 1
 
+if full_sync:
+    print("Downloading all activities...")
+    after = ''
+else:
+    print("Downloading activities since " + str(pd.Timestamp(overview_sync['after'], unit='s')) + "...")
+    # one second back so an activity starting on the same second as the newest one is not missed
+    after = '&after=' + str(int(overview_sync['after']) - 1)
+
 while True:
     # get page of activities from Strava
-    page_json = requests.get(url + '?access_token=' + access_token + '&per_page=200' + '&page=' + str(page)).json()
+    page_json = requests.get(url + '?access_token=' + access_token + '&per_page=200' + '&page=' + str(page) +
+                             after).json()
 
     for a in range(len(page_json)):
         # (https://stackoverflow.com/questions/21104592/)
         activity_json = pd.json_normalize(page_json[a])
-        activities_overview = activities_overview.append(activity_json, ignore_index=True)
+        activities_new = pd.concat([activities_new, activity_json], ignore_index=True)
 
     # if no results then exit loop
     if (not page_json):
@@ -104,17 +134,56 @@ while True:
     # increment page
     page += 1
 
-# makes sense since new added on bottom
-activities_overview = activities_overview.sort_values(by='id', ascending=True)
+if full_sync and not activities_new.empty:
+    # makes sense since new added on bottom
+    activities_overview = activities_new.sort_values(by='id', ascending=True)
+
+    activities_overview.to_csv('activities_overview.csv', header=True)
+    overview_sync['last_full_sync'] = int(time.time())
+
+elif not activities_new.empty:
+    # merge the new activities into the stored overview by appending them to the end of the csv file
+    activities_new = activities_new[~activities_new['id'].isin(activities_overview['id'])]
+    activities_new = activities_new.sort_values(by='id', ascending=True)
+    activities_new = activities_new.reindex(columns=activities_overview.columns)
+    activities_new.index = range(activities_overview.index.max() + 1,
+                                 activities_overview.index.max() + 1 + len(activities_new))
+
+    activities_new.to_csv('activities_overview.csv', mode='a', header=False)
+    activities_overview = pd.concat([activities_overview, activities_new])
 
 # activities_overview.tail(5)
 
+print("Number of Activities Downloaded:   ", len(activities_new))
 print("Number of Strava Activities Found: ", activities_overview.shape)
 print("")
 
-activities_overview.to_csv('activities_overview.csv', header=True)
+# high-water mark for the next run
+if not activities_overview.empty:
+    newest = pd.to_datetime(activities_overview['start_date'], utc=True).idxmax()
+    overview_sync['after'] = int(pd.Timestamp(activities_overview['start_date'][newest]).timestamp())
+    overview_sync['latest_id'] = int(activities_overview['id'][newest])
+
+with open(sync_file, 'w') as f:
+    json.dump(overview_sync, f)
+
 print("OVERVIEW CSV FILE UPDATED\n")
 
+# ## Activity Table for Joining to the Streams
+# the date, name and type of each activity are stored once here instead of on every row of the details, join them
+# when they are needed:  activities_details.join(activities_activity, on='id')
+activities_activity = activities_overview.set_index('id')[['start_date_local', 'name', 'type']]
+activities_activity = activities_activity.rename(columns={'start_date_local': 'date'})
+
+# activities imported from files by saros-fit-import.py have negative ids and are not in the overview
+try:
+    activities_imported = pd.read_pickle('activities_activity.pkl')
+    activities_activity = pd.concat([activities_activity, activities_imported[activities_imported.index < 0]])
+except:
+    pass
+
+activities_activity.to_pickle('activities_activity.pkl')
+
 
 # ## Create Dataframe with DETAILED ACTIVITY DATA Streams for New Activities *(Strava API)*
 # Streams Available via Strava API (https://developers.strava.com/docs/reference/#api-models-StreamSet)
@@ -151,12 +220,9 @@ def activity_streams(id):
         except:
             a_df[streams_list[a]] = np.nan
 
+    # each row is one sample, keyed by (id, sample), the activity's date, name and type are in activities_activity
     a_df['id'] = id
-    idx = activities_overview.index[activities_overview['id'] == id].tolist()[0]
-
-    a_df['date'] = activities_overview['start_date_local'][idx]
-    a_df['name'] = activities_overview['name'][idx]
-    a_df['type'] = activities_overview['type'][idx]
+    a_df['sample'] = range(len(a_df))
 
     return a_df
 
@@ -167,6 +233,11 @@ try:
 except:
     activities_details = pd.DataFrame()
 
+# details downloaded before the activity table copied the date, name and type onto every row
+activities_details = activities_details.drop(columns=['date', 'name', 'type'], errors='ignore')
+if 'id' in activities_details.columns and 'sample' not in activities_details.columns:
+    activities_details['sample'] = activities_details.groupby('id').cumcount()
+
 # activities_details.info()
 # activities_details.tail()
 
@@ -174,6 +245,12 @@ except:
 # ### Download only Details for New Activities
 # (https://thispointer.com/pandas-check-if-a-value-exists-in-a-dataframe-using-in-not-in-operator-isin/)
 
+# activities deleted on Strava only drop out of the overview on a full sync (imported activities have negative ids)
+if full_sync and 'id' in activities_details.columns:
+    activities_details = activities_details[activities_details['id'].isin(activities_overview['id']) |
+                                            (activities_details['id'] < 0)]
+    activities_details = activities_details.reset_index(drop=True)
+
 a_details_to_import = []
 try:
     a_already_downloaded = activities_details['id'].unique()
@@ -215,7 +292,7 @@ while a_range_l < a_number:
     for a in a_details_to_import[a_range_l:a_range_h]:
         print('Downloading activity ', a)
         a_df_curr = activity_streams(a)
-        activities_details = activities_details.append(a_df_curr, ignore_index=True) 
+        activities_details = pd.concat([activities_details, a_df_curr], ignore_index=True) 
 
     # 90 rather than 100 to be safe
     a_range_l = a_range_l + 90
@@ -236,4 +313,14 @@ activities_details.to_csv('activities_details.csv', header=True)
 
 print("\nDETAILED CSV and PKL FILES UPDATED")
 print("")
+
+# ## Update Files Built from the Activity Details
+# each one is a separate script so it can also be run on its own
+post_sync_scripts = ['saros-fit-codec.py', 'saros-fit-pyramid.py', 'saros-fit-best-efforts.py',
+                     'saros-fit-rollups.py']
+
+for s in post_sync_scripts:
+    print("Running " + s)
+    subprocess.run([sys.executable, join(dirname(os.path.abspath(__file__)), s)])
+
 print("EXITING SAROS FIT")
\ No newline at end of file
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# coding: utf-8
+# ---
+# # Downsampled Activity Streams for Fast Plotting
+#
+# A long ride has tens of thousands of samples per stream, far more than there are pixels across a chart.  For each
+# activity and stream this script keeps a pyramid of min/max decimated copies (8000, 4000, 2000, 1000 and 500 points)
+# in activities_pyramid.sfp next to activities_details.sfc.  Each level keeps the lowest and highest sample of every
+# bucket, so power and heartrate spikes are still visible at the coarsest level.  A level is only kept when it has at
+# most half the samples of the stream, so short activities have few levels or none, and a chart wider than the
+# finest level reads the stream itself from activities_details.sfc.
+#
+# Like activities_details.sfc the file starts with a json header holding the offset of every level, followed by the
+# levels as float32 time and value arrays.  Loading only reads the header and maps the file into memory, so plotting
+# one activity only reads that activity's points.
+#
+# Running the script only builds the pyramid for activities that are new or whose streams were downloaded again.
+# The sync scripts run it after the details are updated.
+#
+# To plot from a notebook:
+#   import importlib
+#   pyramid = importlib.import_module('saros-fit-pyramid')
+#   levels = pyramid.load_pyramid()
+#   x, y = pyramid.pyramid_query(levels, 4998708851, 'watts', 1200)
+# ---
+
+# import libraries
+import numpy as np
+import pandas as pd
+
+import os
+import json
+import struct
+import importlib
+
+codec = importlib.import_module('saros-fit-codec')
+
+pyramid_file = 'activities_pyramid.sfp'
+pyramid_magic = b'SFP1'
+
+# number of points at each level, finest first
+pyramid_levels = [8000, 4000, 2000, 1000, 500]
+
+# streams to plot against time (latlng and moving are not plotted as lines)
+pyramid_streams = ['distance','altitude','velocity_smooth','heartrate','cadence','watts','temp','grade_smooth']
+
+
+# ## Min/Max Decimation
+# split the samples into equal buckets and keep the minimum and maximum of each one, in time order
+def minmax_decimate(x, y, n_points):
+    n_buckets = n_points // 2
+
+    # buckets differ in size by at most one sample, so every bucket holds real samples
+    starts = np.linspace(0, len(y), n_buckets + 1).astype(np.int64)[:-1]
+    bucket = np.repeat(np.arange(n_buckets), np.diff(np.append(starts, len(y))))
+
+    # position of the first minimum and first maximum of each bucket
+    i_min = np.flatnonzero(y == np.minimum.reduceat(y, starts)[bucket])
+    i_min = i_min[np.unique(bucket[i_min], return_index=True)[1]]
+    i_max = np.flatnonzero(y == np.maximum.reduceat(y, starts)[bucket])
+    i_max = i_max[np.unique(bucket[i_max], return_index=True)[1]]
+
+    first = np.minimum(i_min, i_max)
+    last = np.maximum(i_min, i_max)
+
+    x_out = np.column_stack([x[first], x[last]]).ravel()
+    y_out = np.column_stack([y[first], y[last]]).ravel()
+
+    return x_out, y_out
+
+
+def build_levels(x, y):
+    levels = {}
+    samples = len(y)
+
+    # each level is made from the next finer one so the whole pyramid costs about as much as one pass over the stream
+    for n_points in pyramid_levels:
+        if 2 * n_points > samples:
+            continue
+        x, y = minmax_decimate(x, y, n_points)
+        levels[n_points] = (x.astype(np.float32), y.astype(np.float32))
+
+    return levels
+
+
+def activity_pyramid(a_df):
+    a_pyramid = {}
+    x = pd.to_numeric(a_df['time'], errors='coerce').to_numpy(dtype=float)
+
+    for s in pyramid_streams:
+        if s not in a_df.columns:
+            continue
+
+        y = pd.to_numeric(a_df[s], errors='coerce')
+
+        # stream not recorded for this activity (e.g. no power meter)
+        if y.isna().all():
+            continue
+
+        y = y.ffill().bfill().to_numpy(dtype=float)
+        levels = build_levels(x, y)
+
+        # too short for any level, plotted from the stream itself
+        if levels:
+            a_pyramid[s] = levels
+
+    return a_pyramid
+
+
+# ## Pyramid File
+# pyramid is {id: {'samples': n, 'streams': {stream: {n_points: (x, y)}}}}
+def write_pyramid(pyramid, filename=pyramid_file):
+    header = {'activities': []}
+    body = []
+    offset = 0
+
+    for a, entry in pyramid.items():
+        a_streams = {}
+        for s, levels in entry['streams'].items():
+            a_streams[s] = {}
+            for n_points, (x, y) in levels.items():
+                b = np.concatenate([x, y]).astype('<f4').tobytes()
+                a_streams[s][str(n_points)] = offset
+                body.append(b)
+                offset += len(b)
+
+        header['activities'].append({'id': int(a), 'samples': int(entry['samples']), 'streams': a_streams})
+
+    header = json.dumps(header).encode('utf-8')
+
+    # the old file may still be mapped into memory, so it is replaced rather than written over
+    with open(filename + '.tmp', 'wb') as f:
+        f.write(pyramid_magic)
+        f.write(struct.pack('<Q', len(header)))
+        f.write(header)
+        for b in body:
+            f.write(b)
+
+    os.replace(filename + '.tmp', filename)
+
+
+# ## Query
+# reads only the header, the levels are read from the mapped file when they are asked for
+def load_pyramid(filename=pyramid_file):
+    try:
+        with open(filename, 'rb') as f:
+            if f.read(4) != pyramid_magic:
+                raise ValueError(filename + ' is not a pyramid file')
+            length = struct.unpack('<Q', f.read(8))[0]
+            header = json.loads(f.read(length))
+    except:
+        return {'buffer': None, 'start': 0, 'activities': {}}
+
+    return {'buffer': np.memmap(filename, dtype=np.uint8, mode='r'), 'start': 12 + length,
+            'activities': {a['id']: a for a in header['activities']}}
+
+
+def pyramid_level(pyramid, offset, n_points):
+    data = np.frombuffer(pyramid['buffer'], dtype='<f4', count=2 * n_points, offset=pyramid['start'] + offset)
+    return data[:n_points], data[n_points:]
+
+
+# coarsest level with at least two points (a min and a max) per pixel, or the stream itself if no level is that
+# detailed
+def pyramid_query(pyramid, id, stream, width, filename=codec.codec_file):
+    levels = pyramid['activities'][id]['streams'].get(stream, {})
+
+    for n_points in sorted(int(n) for n in levels):
+        if n_points >= 2 * width:
+            return pyramid_level(pyramid, levels[str(n_points)], n_points)
+
+    a_df = codec.read_streams(filename, ids=[id], columns=['time', stream])
+    return a_df['time'].to_numpy(dtype=float), pd.to_numeric(a_df[stream], errors='coerce').to_numpy(dtype=float)
+
+
+if __name__ == '__main__':
+    # ### Load Activity Details and Pyramid Already Built
+    activities_details = pd.read_pickle('activities_details.pkl')
+    old_pyramid = load_pyramid()
+
+    # ### Keep the Pyramid of Unchanged Activities (activities deleted from the details are left out)
+    samples = activities_details.groupby('id').size()
+    pyramid = {}
+
+    for a in samples.index:
+        entry = old_pyramid['activities'].get(a)
+        if entry is not None and entry['samples'] == samples[a]:
+            pyramid[a] = {'samples': entry['samples'],
+                          'streams': {s: {int(n): pyramid_level(old_pyramid, o, int(n)) for n, o in levels.items()}
+                                      for s, levels in entry['streams'].items()}}
+
+    # ### Build Pyramid only for New Activities (or activities whose streams were downloaded again)
+    a_to_build = [a for a in samples.index if a not in pyramid]
+
+    print("Number of Activities to Downsample:  " + str(len(a_to_build)))
+
+    a_details = activities_details[activities_details['id'].isin(a_to_build)]
+
+    for a, a_df in a_details.groupby('id'):
+        pyramid[a] = {'samples': len(a_df), 'streams': activity_pyramid(a_df)}
+
+    write_pyramid(pyramid)
+
+    print("PYRAMID FILE UPDATED\n")
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# coding: utf-8
+# ---
+# # Weekly, Monthly and Yearly Totals by Activity Type
+#
+# Count, distance, moving and elapsed time, elevation gain and kilojoules summed by week, month and year for each
+# activity type, kept in activities_rollups.pkl so dashboards read them instead of summing the whole overview.
+#
+# The file also keeps what each activity added to the totals.  When the script runs again only activities that are
+# new, edited (e.g. type or distance changed) or deleted since the last run are looked at: their old values are taken
+# off the weeks, months and years they were in and their new values added, so only those buckets change.
+# The sync scripts run it after the overview is updated, and saros-fit-server.py serves the totals at /rollups.
+#
+# From a notebook:
+#   rollups = pd.read_pickle('activities_rollups.pkl')
+#   rollups['month'].loc['2021-06-01']                          every type in June 2021
+#   rollups['week'].groupby(level='start').sum()               all types together
+# ---
+
+# import libraries
+import pandas as pd
+
+rollups_file = 'activities_rollups.pkl'
+
+rollup_periods = {'week': 'W-SUN', 'month': 'M', 'year': 'Y'}
+
+rollup_columns = ['distance', 'moving_time', 'elapsed_time', 'total_elevation_gain', 'kilojoules']
+
+
+# ## What Each Activity Adds to the Totals
+def activity_contributions(overview):
+    contributions = overview.set_index('id').reindex(columns=rollup_columns).fillna(0).astype(float)
+    contributions['count'] = 1.0
+    contributions['type'] = overview.set_index('id')['type']
+
+    # start_date_local is the athlete's local time even though it ends in Z
+    dates = pd.to_datetime(overview.set_index('id')['start_date_local'], utc=True).dt.tz_localize(None)
+    for period, freq in rollup_periods.items():
+        contributions[period] = dates.dt.to_period(freq).dt.start_time
+
+    return contributions
+
+
+# sum of the rows into their period and type, sign -1 to take activities back off the totals
+def bucket_totals(contributions, period, sign):
+    values = contributions[['count'] + rollup_columns] * sign
+    values['start'] = contributions[period]
+    values['type'] = contributions['type']
+    return values.groupby(['start', 'type']).sum()
+
+
+def update_rollups(rollups, removed, added):
+    for period in rollup_periods:
+        delta = pd.concat([bucket_totals(removed, period, -1), bucket_totals(added, period, 1)])
+        delta = delta.groupby(level=['start', 'type']).sum()
+
+        table = rollups[period].add(delta, fill_value=0)
+
+        # weeks, months and years with no activities of a type left
+        rollups[period] = table[table['count'] > 0].sort_index()
+
+    return rollups
+
+
+if __name__ == '__main__':
+    activities_overview = pd.read_csv('activities_overview.csv', index_col=0)
+    current = activity_contributions(activities_overview)
+
+    try:
+        rollups = pd.read_pickle(rollups_file)
+    except:
+        empty = pd.DataFrame(columns=['count'] + rollup_columns,
+                             index=pd.MultiIndex.from_arrays([[], []], names=['start', 'type']), dtype=float)
+        rollups = {'contributions': current.iloc[:0]}
+        rollups.update({period: empty for period in rollup_periods})
+
+    previous = rollups['contributions']
+
+    # ### Activities New, Edited or Deleted since the Last Run
+    common = current.index.intersection(previous.index)
+    edited = common[(current.loc[common] != previous.loc[common]).any(axis=1).to_numpy()]
+    new = current.index.difference(previous.index)
+    deleted = previous.index.difference(current.index)
+
+    print("Activities New: " + str(len(new)) + "  Edited: " + str(len(edited)) + "  Deleted: " + str(len(deleted)))
+
+    removed = previous.loc[edited.union(deleted)]
+    added = current.loc[edited.union(new)]
+
+    rollups = update_rollups(rollups, removed, added)
+    rollups['contributions'] = current
+
+    pd.to_pickle(rollups, rollups_file)
+
+    print("ROLLUPS PKL FILE UPDATED\n")
@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+# coding: utf-8
+# ---
+# # Activity Details Server
+#
+# Every notebook that reads activities_details.pkl spends seconds to minutes and gigabytes of memory loading the whole
+# history, only to look at a few activities.  This server loads it once, keeps each stream as one compact numpy
+# array (float32 where Strava's precision allows, latlng split into lat and lng) sorted by activity, and serves
+# slices of it over http on this machine:
+#
+#   GET /activities                                   date, name and type of every activity
+#   GET /streams?ids=4998708851,5012345678            all streams for those activities
+#   GET /streams?type=Run&after=2021-01-01&columns=time,distance,heartrate,name
+#   GET /rollups?period=month&type=Ride               totals from saros-fit-rollups.py (week, month or year)
+#
+# date, name and type can be asked for as columns and are joined from activities_activity.pkl.  Responses are Arrow
+# IPC streams when pyarrow is installed (the numpy slices are handed to Arrow without copying), otherwise json; add
+# format=json to force json.  The files are checked every few seconds and reloaded after each sync, requests keep
+# using the old copy until the new one is ready.
+#
+# From a notebook:
+#   import pyarrow as pa, requests
+#   res = requests.get('http://localhost:8765/streams', params={'ids': '4998708851', 'columns': 'time,watts'})
+#   df = pa.ipc.open_stream(res.content).read_pandas()
+# ---
+
+# import libraries
+import numpy as np
+import pandas as pd
+
+import os
+import json
+import time
+import threading
+import importlib
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+codec = importlib.import_module('saros-fit-codec')
+
+server_port = 8765
+details_file = 'activities_details.pkl'
+activity_file = 'activities_activity.pkl'
+rollups_file = 'activities_rollups.pkl'
+
+# seconds between checks for new files
+reload_interval = 5
+
+# smallest type that keeps the precision Strava sends
+stream_dtypes = {
+    'time': np.float64,
+    'distance': np.float64,
+    'lat': np.float64,
+    'lng': np.float64,
+    'altitude': np.float32,
+    'velocity_smooth': np.float32,
+    'heartrate': np.float32,
+    'cadence': np.float32,
+    'watts': np.float32,
+    'temp': np.float32,
+    'moving': np.float32,
+    'grade_smooth': np.float32,
+}
+
+activity_columns = ['date', 'name', 'type']
+
+
+# ## Columnar Copy of the Activity Details
+class ActivityStore:
+
+    def __init__(self):
+        self.mtimes = file_mtimes()
+
+        details = pd.read_pickle(details_file)
+        if 'sample' not in details.columns:
+            details['sample'] = details.groupby('id').cumcount()
+        details = details.sort_values(by=['id', 'sample'], kind='stable').reset_index(drop=True)
+
+        try:
+            self.activity = pd.read_pickle(activity_file)
+        except:
+            self.activity = pd.DataFrame(columns=activity_columns)
+
+        try:
+            self.rollups = pd.read_pickle(rollups_file)
+        except:
+            self.rollups = {}
+
+        # rows of each activity are one contiguous slice of every column
+        ids = details['id'].to_numpy(dtype=np.int64)
+        self.ids, self.starts = np.unique(ids, return_index=True)
+        self.ends = np.append(self.starts[1:], len(ids))
+
+        self.columns = {'id': ids, 'sample': details['sample'].to_numpy(dtype=np.int32)}
+
+        lat, lng = codec.split_latlng(details['latlng'].tolist()) if 'latlng' in details.columns else (None, None)
+        for s, dtype in stream_dtypes.items():
+            if s == 'lat':
+                values = lat
+            elif s == 'lng':
+                values = lng
+            elif s == 'moving' and s in details.columns:
+                values = details[s].map({True: 1.0, False: 0.0, 'True': 1.0, 'False': 0.0})
+            elif s in details.columns:
+                values = pd.to_numeric(details[s], errors='coerce')
+            else:
+                continue
+            self.columns[s] = np.asarray(values, dtype=dtype)
+
+        self.rows = len(ids)
+        print("Loaded " + str(len(self.ids)) + " activities, " + str(self.rows) + " rows")
+
+    # activity ids matching the filters, only those that have streams
+    def select(self, ids=None, types=None, after=None, before=None):
+        selected = pd.Index(self.ids)
+
+        if ids is not None:
+            selected = selected[selected.isin(ids)]
+        if types is not None:
+            selected = selected[self.activity['type'].reindex(selected).isin(types).to_numpy()]
+        if after is not None or before is not None:
+            dates = pd.to_datetime(self.activity['date'].reindex(selected), utc=True).dt.tz_localize(None)
+            if after is not None:
+                selected = selected[(dates >= pd.Timestamp(after)).to_numpy()]
+                dates = dates[dates >= pd.Timestamp(after)]
+            if before is not None:
+                selected = selected[(dates < pd.Timestamp(before)).to_numpy()]
+
+        return selected.to_numpy(dtype=np.int64)
+
+    def streams(self, ids, columns):
+        pos = np.searchsorted(self.ids, ids)
+        slices = [slice(self.starts[p], self.ends[p]) for p in pos]
+
+        out = {}
+        for c in columns:
+            if c in activity_columns:
+                # lazy join of the activity's date, name and type, one value per row
+                values = self.activity[c].reindex(ids).to_numpy(dtype=object)
+                out[c] = np.repeat(values, [s.stop - s.start for s in slices])
+            elif c in self.columns:
+                # a single activity is a view of the column, no copy
+                if len(slices) == 0:
+                    out[c] = self.columns[c][:0]
+                elif len(slices) == 1:
+                    out[c] = self.columns[c][slices[0]]
+                else:
+                    out[c] = np.concatenate([self.columns[c][s] for s in slices])
+
+        return out
+
+
+def file_mtimes():
+    return {f: os.path.getmtime(f) for f in (details_file, activity_file, rollups_file) if os.path.exists(f)}
+
+
+# ## Hot Reload After Each Sync
+def reload_store():
+    global store
+
+    while True:
+        time.sleep(reload_interval)
+
+        if file_mtimes() != store.mtimes:
+            try:
+                print("Activity files changed, reloading...")
+                # the old store keeps serving until the new one is complete
+                store = ActivityStore()
+            except Exception as e:
+                # a sync may still be writing the file, try again on the next check
+                print("Reload failed: " + str(e))
+
+
+# ## HTTP API
+class ServerHandler(BaseHTTPRequestHandler):
+
+    def send_body(self, code, content_type, body):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_columns(self, columns, as_json):
+        if pa is not None and not as_json:
+            table = pa.table({c: pa.array(v, from_pandas=True) for c, v in columns.items()})
+            sink = pa.BufferOutputStream()
+            with pa.ipc.new_stream(sink, table.schema) as writer:
+                writer.write_table(table)
+            self.send_body(200, 'application/vnd.apache.arrow.stream', sink.getvalue().to_pybytes())
+        else:
+            body = {c: [None if isinstance(x, float) and np.isnan(x) else x for x in np.asarray(v).tolist()]
+                    for c, v in columns.items()}
+            self.send_body(200, 'application/json', json.dumps(body).encode('utf-8'))
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        as_json = query.get('format') == 'json'
+
+        # requests use the store as it was when they arrived, even if a reload swaps it part way through
+        current = store
+
+        try:
+            if url.path == '/activities':
+                activity = current.activity.rename_axis('id').reset_index()
+                self.send_columns({c: activity[c].to_numpy() for c in activity.columns}, as_json)
+
+            elif url.path == '/streams':
+                ids = [int(a) for a in query['ids'].split(',')] if 'ids' in query else None
+                types = query['type'].split(',') if 'type' in query else None
+                columns = query['columns'].split(',') if 'columns' in query else list(current.columns)
+
+                # latlng is kept as two columns
+                if 'latlng' in columns:
+                    i = columns.index('latlng')
+                    columns[i:i + 1] = ['lat', 'lng']
+                if 'id' not in columns:
+                    columns = ['id'] + columns
+
+                selected = current.select(ids, types, query.get('after'), query.get('before'))
+                self.send_columns(current.streams(selected, columns), as_json)
+
+            elif url.path == '/rollups':
+                rollups = current.rollups[query.get('period', 'month')].reset_index()
+                if 'type' in query:
+                    rollups = rollups[rollups['type'].isin(query['type'].split(','))]
+                rollups['start'] = rollups['start'].dt.strftime('%Y-%m-%d')
+                self.send_columns({c: rollups[c].to_numpy() for c in rollups.columns}, as_json)
+
+            elif url.path == '/status':
+                body = {'activities': len(current.ids), 'rows': current.rows, 'files': current.mtimes}
+                self.send_body(200, 'application/json', json.dumps(body).encode('utf-8'))
+
+            else:
+                self.send_body(404, 'application/json', json.dumps({'error': 'not found'}).encode('utf-8'))
+
+        except (ValueError, KeyError) as e:
+            self.send_body(400, 'application/json', json.dumps({'error': str(e)}).encode('utf-8'))
+
+        # answer instead of dropping the connection
+        except Exception as e:
+            self.send_body(500, 'application/json', json.dumps({'error': str(e)}).encode('utf-8'))
+
+
+if __name__ == '__main__':
+    store = ActivityStore()
+    threading.Thread(target=reload_store, daemon=True).start()
+
+    # only listen on this machine
+    server = ThreadingHTTPServer(('127.0.0.1', server_port), ServerHandler)
+    print('Serving activity details on port ', server_port)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+    print("\nEXITING SAROS FIT SERVER\n")
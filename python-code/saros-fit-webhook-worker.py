@@ -0,0 +1,330 @@
+#!/usr/bin/env python
+# coding: utf-8
+# ---
+# # Apply Queued Strava Webhook Events to the Activity Files
+#
+# saros-fit-webhook.py puts the ids of created, updated and deleted activities on the queue in activities_queue.db.
+# This worker drains that queue and patches activities_overview and activities_details in place:
+#    - create:  download the summary and the 11 detailed streams for just that activity
+#    - update:  download the summary again (title, type, etc.), streams only if they were never downloaded
+#               (the date, name and type are only kept in activities_activity, so an update is one row and the
+#               details are not written again)
+#    - delete:  drop the activity from the overview and the details
+#
+# Events are only removed from the queue after the files have been saved, so nothing is lost if the worker stops.
+# An event is only dropped when Strava says the activity does not exist (404); on a rate limit (429) or server error
+# it stays queued and the worker backs off.
+# ---
+
+# import libraries
+import requests
+import urllib3
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+import numpy as np
+import pandas as pd
+
+import os
+from os.path import join, dirname
+import sys
+import subprocess
+import time
+import importlib
+from dotenv import load_dotenv
+
+# the receiver owns the queue table
+webhook = importlib.import_module('saros-fit-webhook')
+
+# seconds between checks of an empty queue
+poll_interval = 30
+
+# 90 rather than 100 to be safe (100 requests per 15min limit and 1000 per day), shared with the sync scripts
+rate_budget = [90, 990]
+rate_usage = [0, 0]
+
+# seconds to wait after a Strava server error
+error_backoff = 60
+
+# files built from the streams, only made again when a batch changed some streams
+post_sync_scripts = ['saros-fit-codec.py', 'saros-fit-pyramid.py', 'saros-fit-best-efforts.py',
+                     'saros-fit-rollups.py']
+
+# ## Connect to Strava -- Get Current Access Token
+# (https://www.realpythonproject.com/3-ways-to-store-and-read-credentials-locally-in-python/)
+credential_file = join(os.getcwd(), 'strava-credentials.env')
+
+load_dotenv(credential_file)
+client_id = os.environ.get('client_id')
+client_secret = os.environ.get('client_secret')
+refresh_token = os.environ.get('refresh_token')
+
+# (https://github.com/franchyze923/Code_From_Tutorials/blob/master/Strava_Api/strava_api.py)
+auth_url = "https://www.strava.com/oauth/token"
+
+payload = {
+    'client_id': client_id,
+    'client_secret': client_secret,
+    'refresh_token': refresh_token,
+    'grant_type': "refresh_token",
+    'f': 'json'
+}
+
+access_token = None
+access_token_expires = 0
+
+
+# the worker runs for days, so get a new token whenever the current one is about to expire
+def get_access_token():
+    global access_token, access_token_expires
+
+    if access_token is None or time.time() > access_token_expires - 60:
+        print("\nRequesting Token...")
+        res = requests.post(auth_url, data=payload, verify=False).json()
+        access_token = res['access_token']
+        access_token_expires = res['expires_at']
+        print("Access Token Received!")
+
+    return access_token
+
+
+# ## Load Already Downloaded Activity Files
+def load_activities():
+    try:
+        overview = pd.read_csv('activities_overview.csv', index_col=0)
+    except:
+        overview = pd.DataFrame()
+
+    try:
+        details = pd.read_pickle('activities_details.pkl')
+    except:
+        details = pd.DataFrame()
+
+    # details downloaded before the activity table copied the date, name and type onto every row
+    details = details.drop(columns=['date', 'name', 'type'], errors='ignore')
+    if 'id' in details.columns and 'sample' not in details.columns:
+        details['sample'] = details.groupby('id').cumcount()
+
+    return overview, details
+
+
+def save_activities(overview, details, streams_changed, types_changed):
+    overview = overview.sort_values(by='id', ascending=True)
+    overview.to_csv('activities_overview.csv', header=True)
+
+    # a renamed activity only changes its one row here, not the rows of its streams
+    activity = overview.set_index('id')[['start_date_local', 'name', 'type']]
+    activity = activity.rename(columns={'start_date_local': 'date'})
+
+    # activities imported from files by saros-fit-import.py have negative ids and are not in the overview
+    try:
+        imported = pd.read_pickle('activities_activity.pkl')
+        activity = pd.concat([activity, imported[imported.index < 0]])
+    except:
+        pass
+
+    activity.to_pickle('activities_activity.pkl')
+
+    if streams_changed:
+        details.to_pickle('activities_details.pkl')
+        details.to_csv('activities_details.csv', header=True)
+
+        # same files built from the details as after a full sync
+        scripts = post_sync_scripts
+    else:
+        # a renamed or edited activity only changes the totals, and the best efforts if it became or stopped being
+        # a run
+        scripts = ['saros-fit-best-efforts.py', 'saros-fit-rollups.py'] if types_changed else ['saros-fit-rollups.py']
+
+    for s in scripts:
+        subprocess.run([sys.executable, join(dirname(os.path.abspath(__file__)), s)])
+
+
+# ## Download a Single Activity Summary and its Streams *(Strava API)*
+# Strava returns the requests used in the current 15 minutes and the current day with every response, which includes
+# the requests made by the sync scripts with the same app
+def strava_get(url):
+    global rate_usage
+
+    res = requests.get(url)
+    try:
+        rate_usage = [int(u) for u in res.headers['X-RateLimit-Usage'].split(',')]
+    except:
+        rate_usage = [rate_usage[0] + 1, rate_usage[1] + 1]
+
+    return res
+
+
+def rate_exhausted(needed):
+    return rate_usage[0] + needed > rate_budget[0] or rate_usage[1] + needed > rate_budget[1]
+
+
+# seconds until the 15 minute limit resets on the quarter hour, or the daily limit at midnight UTC
+def rate_reset_wait():
+    global rate_usage
+
+    now = pd.Timestamp.now(tz='UTC')
+    if rate_usage[1] >= rate_budget[1]:
+        reset = now.floor('D') + pd.Timedelta(days=1)
+        rate_usage = [0, 0]
+    else:
+        reset = now.floor('15min') + pd.Timedelta(minutes=15)
+        rate_usage = [0, rate_usage[1]]
+
+    # the real usage is read again from the first response after the wait
+    return max(0, (reset - now).total_seconds())
+
+
+def activity_overview(id):
+    a_url = "https://www.strava.com/api/v3/activities/"
+    res = strava_get(a_url + str(id) + '?access_token=' + get_access_token())
+    if res.status_code != 200:
+        return res.status_code, None
+
+    a_json = pd.json_normalize(res.json())
+
+    # the detailed activity has more fields than the summaries returned by /athlete/activities
+    if not activities_overview.empty:
+        a_json = a_json.reindex(columns=activities_overview.columns)
+
+    return res.status_code, a_json
+
+
+def activity_streams(id):
+    a_df = pd.DataFrame()
+    a_url = "https://www.strava.com/api/v3/activities/"
+
+    streams_list = ['time','distance','latlng','altitude','velocity_smooth','heartrate','cadence','watts','temp',
+                    'moving','grade_smooth']
+
+    res = strava_get(a_url + str(id) + '/streams?access_token=' + get_access_token() +
+                     '&keys=' + ','.join(streams_list) + '&key_by_type=true')
+    if res.status_code != 200:
+        return res.status_code, None
+
+    a_json = pd.json_normalize(res.json())
+
+    for a in range(0,len(streams_list)):
+        try:
+            a_df[streams_list[a]] = a_json[str(streams_list[a]) +'.data'][0]
+        except:
+            a_df[streams_list[a]] = np.nan
+
+    # each row is one sample, keyed by (id, sample), the activity's date, name and type are in activities_activity
+    a_df['id'] = id
+    a_df['sample'] = range(len(a_df))
+
+    return res.status_code, a_df
+
+
+# ## Drain the Queue
+conn = webhook.open_queue()
+
+print('Waiting for queued Strava events...')
+
+try:
+    while True:
+        events = conn.execute('SELECT seq, object_id, aspect_type FROM queue ORDER BY seq').fetchall()
+
+        if not events:
+            time.sleep(poll_interval)
+            continue
+
+        # several events for one activity only need one download, e.g. create followed by a rename
+        aspects = {}
+        last_seq = {}
+        for seq, object_id, aspect_type in events:
+            aspects.setdefault(object_id, set()).add(aspect_type)
+            last_seq[object_id] = seq
+            if aspect_type == 'delete':
+                aspects[object_id] = {'delete'}
+
+        activities_overview, activities_details = load_activities()
+
+        try:
+            a_already_downloaded = set(activities_details['id'].unique())
+        except:
+            a_already_downloaded = set()
+
+        done_seq = []
+        wait = 0
+        streams_changed = False
+        types_changed = False
+
+        for a in sorted(aspects, key=lambda x: last_seq[x]):
+            if 'delete' in aspects[a]:
+                print('Removing activity ', a)
+                if not activities_overview.empty:
+                    activities_overview = activities_overview[activities_overview['id'] != a]
+                if a in a_already_downloaded:
+                    activities_details = activities_details[activities_details['id'] != a]
+                    streams_changed = True
+                done_seq.append(last_seq[a])
+                continue
+
+            needs_streams = 'create' in aspects[a] or a not in a_already_downloaded
+            needed = 2 if needs_streams else 1
+
+            # leave the rest on the queue until the rate limit resets
+            if rate_exhausted(needed):
+                wait = rate_reset_wait()
+                break
+
+            print('Downloading activity ', a)
+            status, a_overview = activity_overview(a)
+
+            # private or already removed activities, nothing to download
+            if status == 404:
+                print('Activity ', a, ' not found, skipping')
+                done_seq.append(last_seq[a])
+                continue
+
+            # rate limit or Strava error, keep the event queued and try again later
+            if status != 200:
+                print('Strava returned ' + str(status) + ' for activity ', a, ', will retry')
+                wait = rate_reset_wait() if status == 429 else error_backoff
+                break
+
+            if needs_streams:
+                status, a_df_curr = activity_streams(a)
+
+                if status != 200 and status != 404:
+                    print('Strava returned ' + str(status) + ' for streams of activity ', a, ', will retry')
+                    wait = rate_reset_wait() if status == 429 else error_backoff
+                    break
+
+                # never replace streams already downloaded with an empty result (e.g. a manual activity has none)
+                if status == 200 and not a_df_curr.empty:
+                    if a in a_already_downloaded:
+                        activities_details = activities_details[activities_details['id'] != a]
+                    activities_details = pd.concat([activities_details, a_df_curr], ignore_index=True)
+                    streams_changed = True
+
+            if not activities_overview.empty:
+                old_type = activities_overview.loc[activities_overview['id'] == a, 'type']
+                types_changed = types_changed or old_type.empty or (old_type != a_overview['type'][0]).any()
+                activities_overview = activities_overview[activities_overview['id'] != a]
+            activities_overview = pd.concat([activities_overview, a_overview], ignore_index=True)
+
+            done_seq.append(last_seq[a])
+
+        if done_seq:
+            save_activities(activities_overview, activities_details.reset_index(drop=True), streams_changed,
+                            types_changed)
+
+            # only forget events once the files that reflect them are saved
+            for a in aspects:
+                if last_seq[a] in done_seq:
+                    conn.execute('DELETE FROM queue WHERE object_id = ? AND seq <= ?', (a, last_seq[a]))
+            conn.commit()
+
+            print('Applied changes for ' + str(len(done_seq)) + ' activities')
+
+        if wait:
+            print('Waiting...')
+            time.sleep(wait)
+
+except KeyboardInterrupt:
+    pass
+
+conn.close()
+print("\nEXITING SAROS FIT WEBHOOK WORKER\n")
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# coding: utf-8
+# ---
+# # Receive Strava Webhook Events and Queue Changed Activities
+#
+# Strava can push an event whenever an activity is created, updated or deleted
+# (https://developers.strava.com/docs/webhooks/).  Rather than re-paging every activity to find out what changed,
+# this small service listens for those events and puts the affected activity ids on a queue stored in
+# activities_queue.db.  The queue is a sqlite file so events survive a restart of the receiver or the worker.
+#
+# saros-fit-webhook-worker.py drains the queue and patches activities_overview and activities_details in place.
+# python_test-scripts/test-webhook.py posts synthetic events to a locally running receiver.
+#
+# Create the push subscription once the receiver is reachable from the internet:
+#   curl -X POST https://www.strava.com/api/v3/push_subscriptions \
+#        -F client_id=##### -F client_secret=##### \
+#        -F callback_url=https://<your host>/webhook -F verify_token=<verify_token>
+# ---
+
+# import libraries
+import os
+from os.path import join
+import json
+import sqlite3
+import time
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from dotenv import load_dotenv
+
+# (https://www.realpythonproject.com/3-ways-to-store-and-read-credentials-locally-in-python/)
+credential_file = join(os.getcwd(), 'strava-credentials.env')
+
+load_dotenv(credential_file)
+verify_token = os.environ.get('verify_token', 'SAROSFIT')
+webhook_port = int(os.environ.get('webhook_port', 8080))
+
+queue_file = 'activities_queue.db'
+
+
+# ## Durable Queue of Activity Events
+def open_queue(filename=queue_file):
+    conn = sqlite3.connect(filename)
+    conn.execute('CREATE TABLE IF NOT EXISTS queue ('
+                 'seq INTEGER PRIMARY KEY AUTOINCREMENT, '
+                 'object_id INTEGER NOT NULL, '
+                 'aspect_type TEXT NOT NULL, '
+                 'event_time INTEGER, '
+                 'received INTEGER NOT NULL)')
+    conn.commit()
+    return conn
+
+
+def enqueue(conn, object_id, aspect_type, event_time):
+    conn.execute('INSERT INTO queue (object_id, aspect_type, event_time, received) VALUES (?, ?, ?, ?)',
+                 (int(object_id), aspect_type, event_time, int(time.time())))
+    conn.commit()
+
+
+# ## Event Receiver
+class WebhookHandler(BaseHTTPRequestHandler):
+
+    def send_json(self, code, body):
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(json.dumps(body).encode('utf-8'))
+
+    # Strava validates the callback url with a GET before creating the subscription
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        mode = query.get('hub.mode', [''])[0]
+        token = query.get('hub.verify_token', [''])[0]
+        challenge = query.get('hub.challenge', [''])[0]
+
+        if mode == 'subscribe' and token == verify_token:
+            print('Subscription validated')
+            self.send_json(200, {'hub.challenge': challenge})
+        else:
+            self.send_json(403, {'error': 'verify token does not match'})
+
+    # Strava expects a 200 within two seconds, so only queue the event here and let the worker do the downloading
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+
+        try:
+            event = json.loads(self.rfile.read(length))
+        except ValueError:
+            self.send_json(400, {'error': 'event is not valid json'})
+            return
+
+        if not isinstance(event, dict) or 'object_id' not in event:
+            self.send_json(400, {'error': 'event has no object_id'})
+            return
+
+        # athlete events (deauthorization) do not change any activity data
+        if event.get('object_type') == 'activity' and event.get('aspect_type') in ('create', 'update', 'delete'):
+            try:
+                enqueue(self.server.queue, event['object_id'], event['aspect_type'], event.get('event_time'))
+            except (TypeError, ValueError):
+                self.send_json(400, {'error': 'object_id is not an activity id'})
+                return
+            print('Queued ' + event['aspect_type'] + ' for activity ', event['object_id'])
+
+        self.send_json(200, {})
+
+
+if __name__ == '__main__':
+    server = HTTPServer(('', webhook_port), WebhookHandler)
+    server.queue = open_queue()
+
+    print('Listening for Strava events on port ', webhook_port)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+    server.queue.close()
+    print("\nEXITING SAROS FIT WEBHOOK\n")